@@ -1,21 +1,33 @@
+import atexit
+import hashlib
+import json
 import os
+import re
 import secrets
+import threading
 import uuid
 import smtplib
 from email.message import EmailMessage
+from functools import lru_cache
+from html import escape
+from pathlib import Path
 from datetime import datetime
 from typing import Dict, Any, Optional, List
 
-import psycopg2
-import psycopg2.extras
-from fastapi import FastAPI, Depends, HTTPException, status, Form
+import psycopg
+from psycopg.rows import dict_row
+from psycopg.types.json import Json
+from psycopg_pool import AsyncConnectionPool
+from fastapi import FastAPI, BackgroundTasks, Depends, HTTPException, Request, status, Form
+from fastapi.concurrency import run_in_threadpool
 from fastapi.security import HTTPBasic, HTTPBasicCredentials
-from fastapi.responses import HTMLResponse, RedirectResponse, FileResponse
+from fastapi.responses import HTMLResponse, ORJSONResponse, RedirectResponse, FileResponse, Response
 
-from reportlab.lib.pagesizes import LETTER
-from reportlab.pdfgen import canvas
+from ferropdf import Engine, Options
 
-app = FastAPI()
+from process import run as process_run
+
+app = FastAPI(default_response_class=ORJSONResponse)
 
 # ------------------------
 # Admin Gate (Basic Auth)
@@ -36,8 +48,21 @@ def require_admin(credentials: HTTPBasicCredentials = Depends(security)):
 # ------------------------
 # DB
 # ------------------------
-def get_conn():
-    return psycopg2.connect(os.getenv("DATABASE_URL"), sslmode="require")
+pool = AsyncConnectionPool(
+    os.getenv("DATABASE_URL", ""),
+    min_size=2,
+    max_size=8,
+    kwargs={"sslmode": "require"},
+    open=False,
+)
+
+@app.on_event("startup")
+async def open_pool():
+    await pool.open()
+
+@app.on_event("shutdown")
+async def close_pool():
+    await pool.close()
 
 # ------------------------
 # Report output dir
@@ -45,20 +70,25 @@ def get_conn():
 REPORT_DIR = os.getenv("REPORT_DIR", "/tmp/grant_forge_reports")
 os.makedirs(REPORT_DIR, exist_ok=True)
 
+_SLUG_RE = re.compile(r"[^A-Za-z0-9 _-]+")
+_SPACE_RE = re.compile(r"[ _-]+")
+
 def safe_slug(s: str) -> str:
-    keep = []
-    for ch in (s or "").strip():
-        if ch.isalnum():
-            keep.append(ch)
-        elif ch in (" ", "-", "_"):
-            keep.append("_")
-    out = "".join(keep).strip("_")
-    return out[:40] if out else "UNKNOWN"
+    s = _SLUG_RE.sub("", (s or "").strip())
+    s = _SPACE_RE.sub("_", s).strip("_")
+    return s[:40] or "UNKNOWN"
 
 # ------------------------
 # Grant-Forge core stub (replace with sealed logic)
 # ------------------------
 def run_grant_forge(intake: Dict[str, Any]) -> str:
+    # Deterministic in its input, so repeat intakes (retries, duplicate
+    # submissions) reuse the cached report keyed by canonical JSON.
+    return _forge_cached(json.dumps(intake, sort_keys=True))
+
+@lru_cache(maxsize=512)
+def _forge_cached(intake_key: str) -> str:
+    intake = json.loads(intake_key)
     grant = intake.get("grant_name", "UNKNOWN")
     entity = intake.get("applicant_entity", "UNKNOWN")
     purpose = intake.get("purpose", "")
@@ -90,32 +120,91 @@ Notes
     return report
 
 # ------------------------
-# PDF writer (reportlab)
+# PDF writer (ferropdf)
 # ------------------------
+# Module-level engine so the font database is cached across requests;
+# render() releases the GIL, so concurrent runs actually parallelize.
+_pdf_engine = Engine(Options(page_size="Letter", margin="20mm"))
+# Warm the engine's font cache at import so the first report doesn't pay
+# the font-load cost.
+_pdf_engine.render("<pre> </pre>")
+
+# ferropdf drops any <pre> block taller than one page, so the report is
+# chunked by estimated rendered height with explicit page breaks between.
+_PDF_WRAP_COLS = 70
+_PDF_LINES_PER_PAGE = 38
+_PDF_PAGE_BREAK = "<div style='page-break-before: always'></div>"
+
+def _report_html(report_text: str) -> str:
+    pages = []
+    chunk: List[str] = []
+    height = 0
+    for line in report_text.split("\n"):
+        h = max(1, (len(line) + _PDF_WRAP_COLS - 1) // _PDF_WRAP_COLS)
+        if chunk and height + h > _PDF_LINES_PER_PAGE:
+            pages.append(chunk)
+            chunk = []
+            height = 0
+        chunk.append(line)
+        height += h
+    pages.append(chunk)
+    return _PDF_PAGE_BREAK.join(
+        "<pre style='font-family:monospace'>" + escape("\n".join(p)) + "</pre>"
+        for p in pages
+    )
+
 def write_report_file(request_id: str, client_name: str, grant_name: str, report_text: str) -> str:
     date_str = datetime.utcnow().strftime("%Y-%m-%d")
     fname = f"{date_str}_GRANTFORGE_{safe_slug(client_name)}_{safe_slug(grant_name)}_REVIEW.pdf"
     path = os.path.join(REPORT_DIR, f"{request_id}_{fname}")
 
-    c = canvas.Canvas(path, pagesize=LETTER)
-    width, height = LETTER
-    x = 40
-    y = height - 40
-    line_height = 14
-
-    for line in report_text.split("\n"):
-        if y < 40:
-            c.showPage()
-            y = height - 40
-        c.drawString(x, y, line)
-        y -= line_height
-
-    c.save()
+    pdf = _pdf_engine.render(_report_html(report_text))
+    with open(path, "wb") as f:
+        f.write(pdf)
     return path
 
 # ------------------------
 # Email sender (SMTP)
 # ------------------------
+class _SMTPSession:
+    """Keeps one authenticated SMTP_SSL connection alive across sends."""
+
+    def __init__(self):
+        self._conn: Optional[smtplib.SMTP_SSL] = None
+        self._lock = threading.Lock()  # send_report_email runs in the threadpool
+
+    def _connect(self) -> smtplib.SMTP_SSL:
+        conn = smtplib.SMTP_SSL(os.getenv("SMTP_HOST"), int(os.getenv("SMTP_PORT", "465")))
+        conn.login(os.getenv("SMTP_USER"), os.getenv("SMTP_PASS"))
+        return conn
+
+    def send(self, msg: EmailMessage):
+        with self._lock:
+            try:
+                if self._conn is None:
+                    self._conn = self._connect()
+                else:
+                    self._conn.noop()
+            except (smtplib.SMTPException, OSError):
+                self._conn = self._connect()
+            try:
+                self._conn.send_message(msg)
+            except smtplib.SMTPServerDisconnected:
+                self._conn = self._connect()
+                self._conn.send_message(msg)
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                try:
+                    self._conn.quit()
+                except (smtplib.SMTPException, OSError):
+                    pass
+                self._conn = None
+
+_smtp_session = _SMTPSession()
+atexit.register(_smtp_session.close)
+
 def send_report_email(to_email: str, pdf_path: str):
     msg = EmailMessage()
     msg["Subject"] = "Grant-Forge Review"
@@ -135,76 +224,82 @@ def send_report_email(to_email: str, pdf_path: str):
             filename=os.path.basename(pdf_path),
         )
 
-    with smtplib.SMTP_SSL(os.getenv("SMTP_HOST"), int(os.getenv("SMTP_PORT", "465"))) as s:
-        s.login(os.getenv("SMTP_USER"), os.getenv("SMTP_PASS"))
-        s.send_message(msg)
+    _smtp_session.send(msg)
 
 # ------------------------
-# Admin UI (HTML)
+# Public pages
 # ------------------------
-@app.get("/admin", response_class=HTMLResponse, dependencies=[Depends(require_admin)])
-def admin_queue():
-    with get_conn() as conn, conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cur:
-        cur.execute("SELECT * FROM requests ORDER BY created_at DESC")
-        rows = cur.fetchall()
+static_dir = Path(__file__).resolve().parent
+_INDEX_BYTES = (static_dir / "index.html").read_bytes()
+_INDEX_ETAG = f'"{hashlib.blake2b(_INDEX_BYTES, digest_size=8).hexdigest()}"'
+
+_HEALTH_BYTES = b'{"ok":true}'
+
+@app.get("/")
+async def home(request: Request):
+    if request.headers.get("if-none-match") == _INDEX_ETAG:
+        return Response(status_code=304)
+    return Response(
+        _INDEX_BYTES,
+        media_type="text/html",
+        headers={"ETag": _INDEX_ETAG},
+    )
 
-    def row_html(r: Dict[str, Any]) -> str:
-        rid = str(r["id"])
-        status_ = r["status"]
+@app.post("/run")
+async def run_process(payload: Dict[str, Any]):
+    return process_run(payload)
 
-        btn_run = ""
-        if status_ in ("APPROVED", "PAID"):
-            btn_run = f"""
+@app.get("/api/health")
+async def health():
+    return Response(
+        _HEALTH_BYTES,
+        media_type="application/json",
+        headers={"Cache-Control": "no-cache", "ETag": '"h1"'},
+    )
+
+# ------------------------
+# Admin UI (HTML)
+# ------------------------
+_BTN_RUN_TMPL = """
               <form method='post' action='/admin/run/{rid}' style='display:inline;'>
                 <button type='submit'>RUN</button>
               </form>
             """
 
-        btn_download = ""
-        if r.get("report_path") and status_ in ("REPORT_READY", "DELIVERED", "ARCHIVED"):
-            btn_download = f" <a href='/admin/download/{rid}'>DOWNLOAD</a> "
+_BTN_DOWNLOAD_TMPL = " <a href='/admin/download/{rid}'>DOWNLOAD</a> "
 
-        btn_delivered = ""
-        if status_ == "REPORT_READY":
-            btn_delivered = f"""
+_BTN_DELIVERED_TMPL = """
               <form method='post' action='/admin/delivered/{rid}' style='display:inline;'>
                 <button type='submit'>MARK DELIVERED</button>
               </form>
             """
 
-        btn_archive = ""
-        if status_ in ("DELIVERED", "REPORT_READY"):
-            btn_archive = f"""
+_BTN_ARCHIVE_TMPL = """
               <form method='post' action='/admin/archive/{rid}' style='display:inline;'>
                 <button type='submit'>ARCHIVE</button>
               </form>
             """
 
-        btn_delete = f"""
+_BTN_DELETE_TMPL = """
           <form method='post' action='/admin/delete/{rid}' style='display:inline;'>
             <button type='submit'>DELETE</button>
           </form>
         """
 
-        intake = r.get("intake") or {}
-        grant_name = intake.get("grant_name", "")
-
-        created = r["created_at"].isoformat(timespec="seconds") if hasattr(r["created_at"], "isoformat") else str(r["created_at"])
-
-        return f"""
+_ROW_TMPL = """
         <tr>
           <td>{created}</td>
-          <td>{r['client_name']}</td>
-          <td>{r['client_email']}</td>
+          <td>{client_name}</td>
+          <td>{client_email}</td>
           <td>{grant_name}</td>
-          <td><b>{status_}</b></td>
-          <td>{btn_run} {btn_download} {btn_delivered} {btn_archive} {btn_delete}</td>
+          <td><b>{status}</b></td>
+          <td>{buttons}</td>
         </tr>
         """
 
-    table = "\n".join(row_html(r) for r in rows)
+PAGE_SIZE = 50
 
-    html = f"""
+_ADMIN_SHELL = """
     <html>
       <head>
         <meta name='viewport' content='width=device-width, initial-scale=1' />
@@ -290,10 +385,56 @@ def admin_queue():
       </body>
     </html>
     """
-    return html
+
+@app.get("/admin", response_class=HTMLResponse, dependencies=[Depends(require_admin)])
+async def admin_queue(page: int = 0):
+    async with pool.connection() as conn, conn.cursor(row_factory=dict_row) as cur:
+        await cur.execute(
+            """
+            SELECT id, created_at, client_name, client_email, status,
+                   intake->>'grant_name' AS grant_name, report_path
+            FROM requests
+            ORDER BY created_at DESC
+            LIMIT %s OFFSET %s
+            """,
+            (PAGE_SIZE, max(page, 0) * PAGE_SIZE),
+        )
+        rows = await cur.fetchall()
+
+    def row_html(r: Dict[str, Any]) -> str:
+        rid = str(r["id"])
+        status_ = r["status"]
+
+        parts: List[str] = []
+        if status_ in ("APPROVED", "PAID"):
+            parts.append(_BTN_RUN_TMPL.format(rid=rid))
+        if r.get("report_path") and status_ in ("REPORT_READY", "DELIVERED", "ARCHIVED"):
+            parts.append(_BTN_DOWNLOAD_TMPL.format(rid=rid))
+        if status_ == "REPORT_READY":
+            parts.append(_BTN_DELIVERED_TMPL.format(rid=rid))
+        if status_ in ("DELIVERED", "REPORT_READY"):
+            parts.append(_BTN_ARCHIVE_TMPL.format(rid=rid))
+        parts.append(_BTN_DELETE_TMPL.format(rid=rid))
+
+        grant_name = r.get("grant_name") or ""
+
+        created = r["created_at"].isoformat(timespec="seconds") if hasattr(r["created_at"], "isoformat") else str(r["created_at"])
+
+        return _ROW_TMPL.format(
+            created=created,
+            client_name=escape(str(r["client_name"] or "")),
+            client_email=escape(str(r["client_email"] or "")),
+            grant_name=escape(str(grant_name or "")),
+            status=status_,
+            buttons=" ".join(parts),
+        )
+
+    table = "\n".join(row_html(r) for r in rows)
+
+    return _ADMIN_SHELL.format(table=table)
 
 @app.post("/admin/new", dependencies=[Depends(require_admin)])
-def admin_new_request(
+async def admin_new_request(
     client_name: str = Form(...),
     client_email: str = Form(...),
     grant_name: str = Form(...),
@@ -304,7 +445,10 @@ def admin_new_request(
     status_: str = Form("PAID"),
     notes: Optional[str] = Form(None),
 ):
+    # Build the full row before checking out a connection so the pooled
+    # connection is never held idle during Python-side work.
     rid = uuid.uuid4()
+    now = datetime.utcnow()
     intake = {
         "grant_name": grant_name.strip(),
         "applicant_entity": applicant_entity.strip(),
@@ -312,98 +456,136 @@ def admin_new_request(
         "use_of_funds": use_of_funds.strip(),
         "deadline_jurisdiction": deadline_jurisdiction.strip(),
     }
-    with get_conn() as conn, conn.cursor() as cur:
-        cur.execute(
+    row = (
+        rid,
+        now,
+        client_name.strip(),
+        client_email.strip(),
+        (status_ or "PAID").strip().upper(),
+        Json(intake),
+    )
+    async with pool.connection() as conn, conn.cursor() as cur:
+        await cur.execute(
             """
             INSERT INTO requests (
               id, created_at, client_name, client_email, status, intake
             ) VALUES (%s, %s, %s, %s, %s, %s)
             """,
-            (
-                rid,
-                datetime.utcnow(),
-                client_name.strip(),
-                client_email.strip(),
-                (status_ or "PAID").strip().upper(),
-                psycopg2.extras.Json(intake),
-            ),
+            row,
         )
     return RedirectResponse(url="/admin", status_code=303)
 
-@app.post("/admin/run/{request_id}", dependencies=[Depends(require_admin)])
-def admin_run(request_id: str):
-    with get_conn() as conn, conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cur:
-        cur.execute("SELECT * FROM requests WHERE id=%s", (request_id,))
-        r = cur.fetchone()
+async def _do_forge_and_mail(request_id: str):
+    async with pool.connection() as conn, conn.cursor(row_factory=dict_row) as cur:
+        await cur.execute("SELECT * FROM requests WHERE id=%s", (request_id,))
+        r = await cur.fetchone()
         if not r:
-            raise HTTPException(status_code=404, detail="Request not found")
-        if r["status"] not in ("APPROVED", "PAID"):
-            return RedirectResponse(url="/admin", status_code=303)
-
-        cur.execute("UPDATE requests SET status=%s WHERE id=%s", ("RUN_STARTED", request_id))
+            return
 
         intake = r["intake"] or {}
         report_text = run_grant_forge(intake)
 
-        report_path = write_report_file(
+        report_path = await run_in_threadpool(
+            write_report_file,
             request_id=str(r["id"]),
             client_name=r["client_name"],
             grant_name=intake.get("grant_name", "UNKNOWN"),
-            report_text=report_text
+            report_text=report_text,
         )
 
-        cur.execute(
+        await cur.execute(
             "UPDATE requests SET status=%s, report_path=%s, report_created_at=%s WHERE id=%s",
             ("REPORT_READY", report_path, datetime.utcnow(), request_id),
+            prepare=True,
         )
-
-    with get_conn() as conn, conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cur:
-        cur.execute("SELECT client_email FROM requests WHERE id=%s", (request_id,))
-        row = cur.fetchone()
-        client_email = row["client_email"] if row else None
-
-    if client_email:
-        send_report_email(client_email, report_path)
-        with get_conn() as conn, conn.cursor() as cur:
-            cur.execute(
+        _report_path_cache[request_id] = report_path
+        # Commit REPORT_READY before the send so a failed email can't
+        # roll back the generated report.
+        await conn.commit()
+
+        client_email = r["client_email"]
+        if client_email:
+            await run_in_threadpool(send_report_email, client_email, report_path)
+            await cur.execute(
                 "UPDATE requests SET status=%s, delivered_at=%s WHERE id=%s",
                 ("DELIVERED", datetime.utcnow(), request_id),
+                prepare=True,
             )
 
+@app.post("/admin/run/{request_id}", dependencies=[Depends(require_admin)])
+async def admin_run(request_id: str, background: BackgroundTasks):
+    async with pool.connection() as conn, conn.cursor(row_factory=dict_row) as cur:
+        await cur.execute("SELECT status FROM requests WHERE id=%s", (request_id,))
+        r = await cur.fetchone()
+        if not r:
+            raise HTTPException(status_code=404, detail="Request not found")
+        if r["status"] not in ("APPROVED", "PAID"):
+            return RedirectResponse(url="/admin", status_code=303)
+
+        await cur.execute(
+            "UPDATE requests SET status=%s WHERE id=%s",
+            ("RUN_STARTED", request_id),
+            prepare=True,
+        )
+
+    background.add_task(_do_forge_and_mail, request_id)
     return RedirectResponse(url="/admin", status_code=303)
 
-@app.get("/admin/download/{request_id}", dependencies=[Depends(require_admin)])
-def admin_download(request_id: str):
-    with get_conn() as conn, conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cur:
-        cur.execute("SELECT report_path FROM requests WHERE id=%s", (request_id,))
-        row = cur.fetchone()
-        if not row or not row.get("report_path"):
-            raise HTTPException(status_code=404, detail="Report not found")
-        path = row["report_path"]
+# request_id -> report_path, so repeat downloads skip the DB round trip
+_report_path_cache: Dict[str, str] = {}
 
-    filename = os.path.basename(path)
-    return FileResponse(path, filename=filename, media_type="application/pdf")
+@app.get("/admin/download/{request_id}", dependencies=[Depends(require_admin)])
+async def admin_download(request_id: str):
+    path = _report_path_cache.get(request_id)
+    if path is None:
+        async with pool.connection() as conn, conn.cursor(row_factory=dict_row) as cur:
+            await cur.execute("SELECT report_path FROM requests WHERE id=%s", (request_id,))
+            row = await cur.fetchone()
+            if not row or not row.get("report_path"):
+                raise HTTPException(status_code=404, detail="Report not found")
+            path = row["report_path"]
+            _report_path_cache[request_id] = path
+
+    try:
+        stat_result = os.stat(path)
+    except FileNotFoundError:
+        _report_path_cache.pop(request_id, None)
+        raise HTTPException(status_code=404, detail="Report not found")
+
+    return FileResponse(
+        path,
+        filename=os.path.basename(path),
+        media_type="application/pdf",
+        stat_result=stat_result,
+        headers={
+            "Cache-Control": "private, max-age=60",
+            "ETag": f'"{stat_result.st_mtime_ns:x}-{stat_result.st_size:x}"',
+        },
+    )
 
 @app.post("/admin/delivered/{request_id}", dependencies=[Depends(require_admin)])
-def admin_mark_delivered(request_id: str):
-    with get_conn() as conn, conn.cursor() as cur:
-        cur.execute(
+async def admin_mark_delivered(request_id: str):
+    async with pool.connection() as conn, conn.cursor() as cur:
+        await cur.execute(
             "UPDATE requests SET status=%s, delivered_at=%s WHERE id=%s AND status=%s",
             ("DELIVERED", datetime.utcnow(), request_id, "REPORT_READY"),
+            prepare=True,
         )
     return RedirectResponse(url="/admin", status_code=303)
 
 @app.post("/admin/archive/{request_id}", dependencies=[Depends(require_admin)])
-def admin_archive(request_id: str):
-    with get_conn() as conn, conn.cursor() as cur:
-        cur.execute(
+async def admin_archive(request_id: str):
+    async with pool.connection() as conn, conn.cursor() as cur:
+        await cur.execute(
             "UPDATE requests SET status=%s, archived_at=%s WHERE id=%s AND status IN (%s, %s)",
             ("ARCHIVED", datetime.utcnow(), request_id, "REPORT_READY", "DELIVERED"),
+            prepare=True,
         )
     return RedirectResponse(url="/admin", status_code=303)
 
 @app.post("/admin/delete/{request_id}", dependencies=[Depends(require_admin)])
-def admin_delete(request_id: str):
-    with get_conn() as conn, conn.cursor() as cur:
-        cur.execute("DELETE FROM requests WHERE id=%s", (request_id,))
+async def admin_delete(request_id: str):
+    _report_path_cache.pop(request_id, None)
+    async with pool.connection() as conn, conn.cursor() as cur:
+        await cur.execute("DELETE FROM requests WHERE id=%s", (request_id,), prepare=True)
     return RedirectResponse(url="/admin", status_code=303)
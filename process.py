@@ -1,6 +1,11 @@
 # process.py
 # Core processing / business logic layer
 
+import re
+from functools import lru_cache
+
+_WORD_RE = re.compile(r"\S+")
+
 def run(payload: dict) -> dict:
     text = payload.get("input")
 
@@ -10,14 +15,19 @@ def run(payload: dict) -> dict:
             "message": "No input provided"
         }
 
-    word_count = len(text.split())
+    return _run(text)
+
+@lru_cache(maxsize=1024)
+def _run(text: str) -> dict:
+    word_count = sum(1 for _ in _WORD_RE.finditer(text))
+    lower = text.lower()
     risk_flags = []
 
     if word_count < 50:
         risk_flags.append("Too little detail")
-    if "budget" not in text.lower():
+    if "budget" not in lower:
         risk_flags.append("No budget mentioned")
-    if "timeline" not in text.lower():
+    if "timeline" not in lower:
         risk_flags.append("No timeline mentioned")
 
     return {